@@ -1,49 +1,106 @@
-from collections import defaultdict
-from dataclasses import dataclass
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from operator import methodcaller
+import errno
+import functools
+import itertools
+import os
 import sublime
 import re
 import sublime_plugin
 import time
 import sys
 import subprocess
+import threading
 
 
 # LSP "Go to symbols" has a similar feature
 # Hope this issue is fixed one day...
 # > https://github.com/sublimehq/sublime_text/issues/4796
-from .utils import DynamicListInputHandler
+from .utils import DynamicListInputHandler, forget_input_view
 
 
-regions_to_add = {}
-init_active_view = {}  # {window: view}
-init_view_sel = {}  # {window: {view: sel}}
-preview_panels = {}
+_pending_search = {}  # {window_id: (token, rg_process, fzf_process)}
+_search_tokens = itertools.count()
+_preview_tokens = itertools.count()
+_result_cache = OrderedDict()  # {(scope, globs, query): ([fzf line], bytes, results)}
+_result_cache_bytes = 0
+# The searches run in the worker thread
+_search_lock = threading.Lock()
 
-current_globs = defaultdict(str)
-current_highlight_index = defaultdict(lambda: -1)
+_STAR_RE = re.compile(r"\*+")
+_to_tuple = methodcaller("to_tuple")
+_IS_WIN = sys.platform.startswith("win")
+# fzf extended search operators, with them the matches of a query
+# are not always a subset of the matches of its prefix
+_FZF_OPERATORS = frozenset("$^!'|")
 
-search_results = ()
+PREVIEW_DELAY_MS = 30
 
+# Number of queries for which we keep the matches, and maximum
+# number of matches to keep them (otherwise we run ripgrep again)
+RESULT_CACHE_SIZE = 32
+MAX_CACHED_LINES = 10000
+# Maximum total size of the cached matches
+MAX_CACHED_BYTES = 16 * 1024 * 1024
 
-@dataclass
+
+@dataclass(frozen=True)
 class SearchResult:
+    # Sublime Text runs Python 3.8, `@dataclass(slots=True)` is not available
+    __slots__ = (
+        "path",
+        "line_number",
+        "line_start",
+        "line_end",
+        "text",
+        "details",
+        "value",
+    )
+
     path: str
     line_number: int
     # Position of the match in the line
-    line_position: "tuple[int, int]"
-    # Region in the IO panel
-    line_content: str
+    line_start: int
+    line_end: int
+    # Computed once, the list items are built again on each update
+    text: str
+    details: str
+    value: str
+
+
+@dataclass
+class TelescopeSession:
+    """State of the telescope input of a window."""
+
+    globs: str = ""
+    highlight_index: int = -1
+    search_results: "list[SearchResult]" = field(default_factory=list)
+    # Focused view and selections before telescope was opened
+    init_active_view: "sublime.View | None" = None
+    init_view_sel: "dict[sublime.View, list[tuple[int, int]]]" = field(
+        default_factory=dict
+    )
+    # Ripgrep arguments for the patterns excluded in the settings
+    exclude_args: "tuple[str, ...]" = ()
+    preview_panel: "sublime.View | None" = None
+    # Regions to set once the preview view is loaded
+    regions_to_add: "tuple[sublime.View, list[SearchResult], int] | None" = None
+    # Token of the preview to show once the highlight stops moving
+    pending_preview: "int | None" = None
+
+
+_sessions = defaultdict(TelescopeSession)  # {window_id: TelescopeSession}
 
 
 class TelescopeCommand(sublime_plugin.WindowCommand):
     """Executed on the output panel, set the result in the view."""
 
     def run(self, result, globs):
-        global search_results
-
-        for view in self.window.views(include_transient=True):
-            view.erase_regions("telescope-result-view")
-        s = search_results[int(result.split(":", 1)[0])]
+        session = _sessions[self.window.id()]
+        session.pending_preview = None
+        _erase_preview_regions(self.window)
+        s = session.search_results[int(result.split(":", 1)[0])]
         # TODO: keep transient view if possible
         self.window.open_file(s.path, flags=sublime.SEMI_TRANSIENT)
 
@@ -52,7 +109,7 @@ class TelescopeCommand(sublime_plugin.WindowCommand):
         # when reloading the command input with the hack in `utils.py`
         if not args:
             _save_initial_state(self.window)
-        return GlobsInputHandler(self, current_globs[self.window])
+        return GlobsInputHandler(self, _sessions[self.window.id()].globs)
 
 
 class GlobsInputHandler(sublime_plugin.TextInputHandler):
@@ -88,9 +145,7 @@ class GlobsInputHandler(sublime_plugin.TextInputHandler):
         return ".py, .js, views/*.html"
 
     def next_input(self, args):
-        global current_globs
-
-        current_globs[self.window] = ", ".join(
+        _sessions[self.window.id()].globs = ", ".join(
             g.strip() for g in args[self.name()].split(",")
         )
         if "result" not in args:
@@ -99,11 +154,16 @@ class GlobsInputHandler(sublime_plugin.TextInputHandler):
 
 class TelescopeListInputHandler(DynamicListInputHandler):
     def __init__(self, window_command, args):
-        global search_results
         super().__init__(window_command, args)
         self.window = window_command.window
         self.window_command = window_command
-        self.search_results = list(search_results)
+        self.session = _sessions[self.window.id()]
+        self.search_results = list(self.session.search_results)
+        if not getattr(window_command, "_reloading", False):
+            # New invocation (maybe with pre-filled args), not the reload
+            # done by `update`, the settings and the files might have changed
+            _start_search_session(self.window)
+        setattr(window_command, "_reloading", False)
 
     def name(self):
         return "result"
@@ -112,8 +172,9 @@ class TelescopeListInputHandler(DynamicListInputHandler):
         return "Fuzzy find"
 
     def cancel(self):
-        for view in self.window_command.window.views(include_transient=True):
-            view.erase_regions("telescope-result-view")
+        _cancel_search(self.window)
+        self.session.pending_preview = None
+        _erase_preview_regions(self.window)
 
         _reset_initial_state(self.window_command.window)
 
@@ -131,31 +192,60 @@ class TelescopeListInputHandler(DynamicListInputHandler):
         Save the highlighted element, so we can re-open the view
         at the same position.
         """
-        global current_highlight_index
         if (text or "").strip():
-            current_highlight_index[self.window] = int(text.split(":", 1)[0])
-            _preview_result(
-                self.window_command.window,
-                self.search_results,
-                current_highlight_index[self.window],
+            index = int(text.split(":", 1)[0])
+            self.session.highlight_index = index
+
+            # When the arrow key is held down, only preview the last result
+            token = next(_preview_tokens)
+            self.session.pending_preview = token
+            sublime.set_timeout(
+                lambda: self._flush_preview(index, token),
+                PREVIEW_DELAY_MS,
             )
 
+    def _flush_preview(self, index, token):
+        if self.session.pending_preview != token:
+            return
+        self.session.pending_preview = None
+        _preview_result(self.window_command.window, self.search_results, index)
+
     def on_modified(self, text: str) -> None:
-        global search_results, current_highlight_index
-        current_highlight_index[self.window] = -1
+        self.session.highlight_index = -1
 
-        search_results = _live_search(
-            self.window_command.window,
-            text,
-            self.args["globs"],
-        )
+        # The input is already debounced, kill the previous search
+        # right away and run the new one in the worker thread
+        token = next(_search_tokens)
+        _cancel_search(self.window, token)
+        globs = self.args["globs"]
+        sublime.set_timeout_async(lambda: self._async_search(text, globs, token))
+
+    def _async_search(self, text, globs, token):
+        """Run the search in the worker thread, to not block the UI."""
+        if not _is_current_search(self.window, token):
+            return
+
+        results = _live_search(self.window, text, globs, token)
+
+        if _is_current_search(self.window, token):
+            # Build the list items here as well, the UI thread
+            # only has to show them
+            items = self._list_items(results)
+            sublime.set_timeout(lambda: self._show_results(results, items, token))
+
+    def _show_results(self, results, items, token):
+        if not _is_current_search(self.window, token):
+            return
+
+        self.session.search_results = results
 
         setattr(
             self.command,
             "_selection",
-            [s.to_tuple() for s in self.input_view.sel()],
+            list(map(_to_tuple, self.input_view.sel())),
         )
-        self.update(self._list_items(search_results))
+        setattr(self.command, "_reloading", True)
+        self.update(items)
 
     def get_list_items(self):
         return self._list_items(self.search_results)
@@ -166,58 +256,217 @@ class TelescopeListInputHandler(DynamicListInputHandler):
 
         return [
             sublime.ListInputItem(
-                text=_fixed_size(s.line_content.strip(), 100),
-                details=_fixed_size(
-                    f"{s.path}:{s.line_number}:{s.line_position[0]}", 100
-                ),
-                # TODO: remove that hack (otherwise it's closed)
-                value=str(i) + ":" + s.line_content.strip(),
+                text=s.text,
+                details=s.details,
+                value=s.value,
                 annotation="",
             )
-            for i, s in enumerate(search_results)
-        ], current_highlight_index[self.window]
+            for s in search_results
+        ], self.session.highlight_index
 
 
 class IoPanelEventListener(sublime_plugin.EventListener):
     def on_load(self, view):
+        if not any(session.regions_to_add for session in _sessions.values()):
+            # No preview is loading, skip the API calls
+            return
         window = view.window()
-        if window in regions_to_add and view == regions_to_add[window][0]:
-            _set_file_view_regions(*regions_to_add[window])
-            del regions_to_add[window]
+        session = window and _sessions.get(window.id())
+        if session and session.regions_to_add and view == session.regions_to_add[0]:
+            regions_to_add = session.regions_to_add
+            session.regions_to_add = None
+            _set_file_view_regions(*regions_to_add)
+
+    def on_post_save_async(self, view):
+        # The cached matches of the file might have changed
+        if view.file_name():
+            _clear_cached_file(view.file_name())
+
+    def on_reload_async(self, view):
+        # Changed outside of Sublime Text
+        if view.file_name():
+            _clear_cached_file(view.file_name())
+
+    def on_pre_close_window(self, window):
+        # Do not keep the views and the processes of a closed window
+        _cancel_search(window)
+        # Another window on the same folders can still use the cached matches
+        folders = window.folders()
+        if not any(w != window and w.folders() == folders for w in sublime.windows()):
+            _clear_cached_lines(window)
+        forget_input_view(window)
+        session = _sessions.pop(window.id(), None)
+        if session:
+            # A preview might still be scheduled
+            session.pending_preview = None
 
 
 def _save_initial_state(window):
-    global init_active_view
-    init_active_view[window] = window.active_view()
+    session = _sessions[window.id()]
+    session.init_active_view = window.active_view()
+    session.init_view_sel = {
+        view: list(map(_to_tuple, view.sel())) for view in window.views()
+    }
 
-    init_view_sel[window] = {}
-    for view in window.views():
-        init_view_sel[window][view] = list(view.sel())
+
+def _start_search_session(window):
+    # The settings are read once, and not on each keystroke
+    _sessions[window.id()].exclude_args = _exclude_glob_args(window.active_view())
 
 
 def _reset_initial_state(window, focus_old_view=True, close_preview=False):
-    global init_active_view, preview_panels
-    if window in init_active_view and focus_old_view:
-        window.focus_view(init_active_view[window])
+    session = _sessions.get(window.id())
+    if not session:
+        return
+    if session.init_active_view and focus_old_view:
+        window.focus_view(session.init_active_view)
 
     if close_preview:
-        preview_panel = preview_panels.get(window)
+        preview_panel = session.preview_panel
         if preview_panel and preview_panel.sheet().is_semi_transient():
             preview_panel.close()
 
-    if window in init_view_sel:
-        for view, sel in init_view_sel[window].items():
-            view.sel().clear()
-            view.sel().add_all(sel)
+    for view, sel in session.init_view_sel.items():
+        view.sel().clear()
+        view.sel().add_all([sublime.Region(a, b) for a, b in sel])
 
 
-def _live_search(window, search_query, globs):
-    global preview_panels, search_results
+def _cancel_search(window, token=None):
+    """Kill the processes of the running search of the window."""
+    with _search_lock:
+        _, *processes = _pending_search.pop(window.id(), (None, None, None))
+        if token is not None:
+            _pending_search[window.id()] = (token, None, None)
+    _kill_processes(processes)
+
+
+def _is_current_search(window, token):
+    return _pending_search.get(window.id(), (None,))[0] == token
+
+
+def _track_search(window, token, rg_process, fzf_process):
+    """Store the processes of the search, so a newer search can kill them.
+
+    If a newer search already started, kill them immediately.
+    """
+    with _search_lock:
+        if _is_current_search(window, token):
+            _pending_search[window.id()] = (token, rg_process, fzf_process)
+            return True
+    _kill_processes((rg_process, fzf_process))
+    return False
+
+
+def _end_search(window, token, rg_process, fzf_process):
+    with _search_lock:
+        if _is_current_search(window, token):
+            _pending_search[window.id()] = (token, None, None)
+    _kill_processes((rg_process, fzf_process))
+
+
+def _kill_processes(processes):
+    for process in processes:
+        if process is not None:
+            process.kill()
+
+
+def _live_search(window, search_query, globs, token):
     if len(search_query) < 3:
         return []
 
     start = time.time()
 
+    cached_results = _get_cached_results(window, globs, search_query)
+    if cached_results is not None:
+        # Same query as before (e.g. removed and typed again)
+        return list(cached_results)
+
+    cached_lines = None
+    # Bytes patterns ignore the case of the ASCII letters only
+    if _FZF_OPERATORS.isdisjoint(search_query) and search_query.isascii():
+        cached_lines = _get_cached_lines(window, globs, search_query)
+    if cached_lines is not None:
+        # fzf matches the whole line, path included, apply the
+        # ripgrep pattern of the new query on the content first
+        cached_lines = _filter_lines(cached_lines, search_query)
+        if not cached_lines:
+            # No need to start fzf
+            return []
+
+    if cached_lines is not None:
+        # The query extends a previous one, its matches are a subset
+        # of the previous matches, no need to scan the files again
+        rg_process = None
+        fzf_process = _create_process(
+            ["fzf", "--filter", search_query],
+            stdin=subprocess.PIPE,
+        )
+        if not _track_search(window, token, rg_process, fzf_process):
+            return []
+        _write_input(fzf_process, b"".join(line + b"\n" for line in cached_lines))
+    else:
+        rg_cmd = _rg_command(window, search_query, globs)
+        print(" ".join(rg_cmd))
+
+        rg_process = _create_process(rg_cmd)
+        fzf_process = _create_process(
+            ["fzf", "--filter", search_query],
+            stdin=rg_process.stdout,
+        )
+        _enlarge_pipe(rg_process.stdout)
+        rg_process.stdout.close()
+        if not _track_search(window, token, rg_process, fzf_process):
+            return []
+
+    try:
+        # Read all the matches (up to a limit), to be able to filter
+        # them again without ripgrep if the user keeps typing
+        lines = _read_lines(fzf_process.stdout, MAX_CACHED_LINES + 1)
+
+        search_results = []
+        for line in lines[:50]:  # Keep first X lines
+            line = line.decode("utf-8", "replace").strip()
+            if not line:
+                continue
+
+            path, line_number, content = _parse_rg_result(line)
+            # Many results come from the same file, share the string
+            path = sys.intern(path)
+            stripped = content.lstrip()
+            to_trim = len(content) - len(stripped)
+            content = stripped.rstrip()
+
+            search_results.append(
+                SearchResult(
+                    path,
+                    int(line_number),
+                    to_trim,
+                    to_trim + len(content),
+                    _fixed_size(content, 100),
+                    _fixed_size(f"{path}:{line_number}:{to_trim}", 100),
+                    # TODO: remove that hack (otherwise it's closed)
+                    f"{len(search_results)}:{content[:100]}",
+                )
+            )
+
+        if (
+            len(lines) <= MAX_CACHED_LINES
+            and _is_current_search(window, token)
+            and fzf_process.wait() >= 0
+            and (rg_process is None or rg_process.wait() >= 0)
+        ):
+            # Neither process has been killed, the matches are complete
+            _set_cached_lines(window, globs, search_query, lines, search_results)
+    finally:
+        # Never leave the processes running
+        _end_search(window, token, rg_process, fzf_process)
+
+    print("Search done in", time.time() - start)
+
+    return search_results
+
+
+def _rg_command(window, search_query, globs):
     rg_cmd = [
         "rg",
         "--no-heading",
@@ -229,84 +478,166 @@ def _live_search(window, search_query, globs):
         "--line-number",
         "--smart-case",
         "-e",
-        ".*" + ".*".join(map(re.escape, search_query)) + ".*",
+        _query_pattern(search_query),
     ]
 
-    view = window.active_view()
-    if view:
-        # The `--iglob` when is negated is done in addition to the
-        # default filter (.gitignore, etc)
-        exclude_patterns = view.settings().get("binary_file_patterns") or []
-        exclude_patterns += view.settings().get("file_exclude_patterns") or []
-        exclude_patterns += [
-            f"**/{f}**/" for f in view.settings().get("folder_exclude_patterns") or []
-        ]
-        for glob in exclude_patterns:
-            glob = re.sub(r"\*+", "**", glob)
-            rg_cmd.extend(("--iglob", f"!**/*{glob}"))
-
-    for glob in globs.split(","):
-        glob = glob.strip()
-        if not glob:
-            continue
-        glob = re.sub(r"\*+", "**", glob)
-        # `--type` exist, but it works only for a fixed list of types
-        # mimic sublime text glob logic
-        rg_cmd.extend(("--iglob", f"**/*{glob}"))
-
+    rg_cmd += _session_exclude_args(window)
+    rg_cmd += _include_glob_args(globs)
     rg_cmd += window.folders()
+    return rg_cmd
 
-    print(" ".join(rg_cmd))
-
-    rg_process = _create_process(rg_cmd)
-    fzf_process = _create_process(
-        ["fzf", "--filter", search_query],
-        stdin=rg_process.stdout,
-    )
-    rg_process.stdout.close()
-    search_results = []
-    for _ in range(50):  # Read first X lines
-        line = fzf_process.stdout.readline().strip()
-        if not line:
-            break
-
-        path, line_number, content = _parse_rg_result(line)
-        to_trim = next((i for i, s in enumerate(content) if s.strip()), 0)
-        content = content.strip()
 
-        search_results.append(
-            SearchResult(
-                path,
-                int(line_number),
-                (to_trim, to_trim + len(content)),
-                content[:200],
-            )
-        )
+def _exclude_glob_args(view):
+    """Convert the patterns excluded in the settings into ripgrep arguments."""
+    if not view:
+        return ()
 
-    rg_process.terminate()
-    fzf_process.terminate()
+    # The `--iglob` when is negated is done in addition to the
+    # default filter (.gitignore, etc)
+    settings = view.settings()
+    exclude_patterns = settings.get("binary_file_patterns") or []
+    exclude_patterns += settings.get("file_exclude_patterns") or []
+    exclude_patterns += [
+        f"**/{f}**/" for f in settings.get("folder_exclude_patterns") or []
+    ]
+    # Remove the duplicates (but keep the order), so ripgrep
+    # has less globs to compile
+    exclude_patterns = dict.fromkeys(
+        _STAR_RE.sub("**", glob) for glob in exclude_patterns
+    )
+    args = []
+    for glob in exclude_patterns:
+        args.extend(("--iglob", f"!**/*{glob}"))
+    return tuple(args)
 
-    print("Search done in", time.time() - start)
 
-    return search_results
+@functools.lru_cache(maxsize=RESULT_CACHE_SIZE)
+def _include_glob_args(globs):
+    """Convert the globs written by the user into ripgrep arguments."""
+    include_patterns = dict.fromkeys(
+        _STAR_RE.sub("**", glob.strip()) for glob in globs.split(",")
+    )
+    args = []
+    for glob in include_patterns:
+        if not glob:
+            continue
+        # `--type` exist, but it works only for a fixed list of types
+        # mimic sublime text glob logic
+        args.extend(("--iglob", f"**/*{glob}"))
+    return tuple(args)
+
+
+@functools.lru_cache(maxsize=RESULT_CACHE_SIZE)
+def _query_pattern(search_query):
+    # The search is not anchored, no need for a leading / trailing `.*`
+    return ".*".join(map(re.escape, search_query))
+
+
+def _cache_scope(window):
+    """Windows searching the same folders with the same excludes share the cache."""
+    return (tuple(window.folders()), _session_exclude_args(window))
+
+
+def _session_exclude_args(window):
+    # Do not re-create the session of a closed window
+    session = _sessions.get(window.id())
+    return session.exclude_args if session else ()
+
+
+def _get_cached_results(window, globs, search_query):
+    """Return the results of the exact same query, if it is cached."""
+    key = (_cache_scope(window), globs, search_query)
+    with _search_lock:
+        if key in _result_cache:
+            _result_cache.move_to_end(key)
+            return _result_cache[key][2]
+    return None
+
+
+def _get_cached_lines(window, globs, search_query):
+    """Return the matches of the longest cached prefix of the query."""
+    scope = _cache_scope(window)
+    for size in range(len(search_query), 2, -1):
+        key = (scope, globs, search_query[:size])
+        with _search_lock:
+            if key in _result_cache:
+                _result_cache.move_to_end(key)
+                return _result_cache[key][0]
+    return None
+
+
+def _set_cached_lines(window, globs, search_query, lines, search_results):
+    global _result_cache_bytes
+    key = (_cache_scope(window), globs, search_query)
+    lines_bytes = sum(map(len, lines))
+    with _search_lock:
+        if key in _result_cache:
+            _result_cache_bytes -= _result_cache.pop(key)[1]
+        _result_cache[key] = (lines, lines_bytes, tuple(search_results))
+        _result_cache_bytes += lines_bytes
+        while (
+            len(_result_cache) > RESULT_CACHE_SIZE
+            or _result_cache_bytes > MAX_CACHED_BYTES
+        ):
+            _result_cache_bytes -= _result_cache.popitem(last=False)[1][1]
+
+
+def _clear_cached_lines(window):
+    """Forget the cached matches of the window's folders."""
+    global _result_cache_bytes
+    folders = tuple(window.folders())
+    with _search_lock:
+        for key in [key for key in _result_cache if key[0][0] == folders]:
+            _result_cache_bytes -= _result_cache.pop(key)[1]
+
+
+def _clear_cached_file(file_name):
+    """Forget the cached matches of the searches that include the file."""
+    global _result_cache_bytes
+    with _search_lock:
+        for key in [
+            key for key in _result_cache if _is_in_folders(file_name, key[0][0])
+        ]:
+            _result_cache_bytes -= _result_cache.pop(key)[1]
+
+
+def _is_in_folders(file_name, folders):
+    file_name = os.path.normcase(file_name)
+    return any(
+        file_name.startswith(os.path.join(os.path.normcase(folder), ""))
+        for folder in folders
+    )
 
 
 def _preview_result(window, search_results, result_index):
     if not search_results:
         return
 
+    session = _sessions.get(window.id())
+    if not session:
+        return
     if (
-        window not in preview_panels
-        or preview_panels[window].file_name() != search_results[result_index].path
-        or not preview_panels[window].sheet()
-        or not preview_panels[window].sheet().is_selected()
+        not session.preview_panel
+        or session.preview_panel.file_name() != search_results[result_index].path
+        or not session.preview_panel.sheet()
+        or not session.preview_panel.sheet().is_selected()
     ):
-        preview_panels[window] = window.open_file(
+        # The previous preview might be a view the user had already
+        # opened, only the current preview must keep the highlight
+        _erase_preview_regions(window)
+        session.regions_to_add = None
+        session.preview_panel = window.open_file(
             search_results[result_index].path,
             flags=sublime.TRANSIENT,
         )
 
-    _set_file_view_regions(preview_panels[window], search_results, result_index)
+    _set_file_view_regions(session.preview_panel, search_results, result_index)
+
+
+def _erase_preview_regions(window):
+    session = _sessions.get(window.id())
+    if session and session.preview_panel:
+        session.preview_panel.erase_regions("telescope-result-view")
 
 
 def _set_file_view_regions(
@@ -317,17 +648,20 @@ def _set_file_view_regions(
     """Set the region in the preview file we opened."""
     if view.is_loading():
         # Need to wait
-        regions_to_add[view.window()] = (view, search_results, result_index)
+        window = view.window()
+        session = window and _sessions.get(window.id())
+        if session:
+            session.regions_to_add = (view, search_results, result_index)
         return
 
     search_result = search_results[result_index]
     line_a = view.text_point(
         search_result.line_number - 1,
-        search_result.line_position[0],
+        search_result.line_start,
     )
     r_view = sublime.Region(
         line_a,
-        line_a - search_result.line_position[0] + search_result.line_position[1],
+        line_a - search_result.line_start + search_result.line_end,
     )
 
     view.sel().clear()
@@ -344,23 +678,101 @@ def _set_file_view_regions(
 
 def _fixed_size(s, size):
     """Make the string having a fixed size."""
-    s = s or ""
-    s = s[:size]
-    s += " " * (size - len(s))
-    return s
+    return (s or "")[:size].ljust(size)
+
+
+def _filter_lines(lines, search_query):
+    """Keep the ripgrep lines whose content matches the query, like ripgrep."""
+    # Same as `--smart-case`
+    flags = 0 if any(c.isupper() for c in search_query) else re.IGNORECASE
+    pattern = re.compile(_query_pattern(search_query).encode(), flags)
+    return [line for line in lines if pattern.search(_line_content(line))]
+
+
+def _line_content(line):
+    """Return the content of a `path:line_number:content` bytes line."""
+    if _IS_WIN and line[1:2] == b":" and line[:1].isalpha():
+        # Drive letter
+        line = line[2:]
+    parts = line.split(b":", 2)
+    return parts[2] if len(parts) == 3 else b""
 
 
 def _parse_rg_result(result):
-    if sys.platform.startswith("win"):
-        drive, path, line_number, content = result.split(":", 3)
+    path, _, rest = result.partition(":")
+    if _IS_WIN and len(path) == 1 and path.isalpha():
+        # Drive letter
+        drive = path
+        path, _, rest = rest.partition(":")
         path = drive + ":" + path
-        return path, line_number, content
-    return result.split(":", 2)
+    line_number, _, content = rest.partition(":")
+    return path, line_number, content
+
+
+def _read_lines(stream, max_lines):
+    """Read the lines of the binary stream, by big chunks.
+
+    Stop once at least `max_lines` lines have been read.
+    """
+    lines = []
+    buffer = bytearray()
+    fd = stream.fileno()
+    while len(lines) < max_lines:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            if buffer:
+                lines.append(bytes(buffer))
+            break
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            # Inside a long line, split it only once it ends
+            buffer += chunk
+            continue
+        buffer += chunk[:end]
+        lines.extend(bytes(buffer).split(b"\n"))
+        buffer = bytearray(chunk[end + 1 :])
+    return lines
+
+
+def _write_input(process, data):
+    """Write all the data to the process stdin, and close it."""
+    # Like `subprocess.Popen._stdin_write`, the process
+    # might have been killed by a newer search
+    try:
+        process.stdin.write(data)
+    except BrokenPipeError:
+        pass
+    except OSError as e:
+        # On Windows, EINVAL is raised instead of EPIPE
+        if e.errno != errno.EINVAL:
+            raise
+
+    try:
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+
+
+def _enlarge_pipe(stream):
+    """Use a 1MiB pipe, so ripgrep does not wait for fzf to read."""
+    if not sys.platform.startswith("linux"):
+        return
+
+    try:
+        import fcntl
+
+        F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+        fcntl.fcntl(stream.fileno(), F_SETPIPE_SZ, 1 << 20)
+    except (ImportError, OSError):
+        pass
 
 
 def _create_process(args, stdin=None):
     cmd_args = {}
-    if sys.platform.startswith("win"):
+    if _IS_WIN:
         CREATE_NO_WINDOW = 0x08000000
         cmd_args["creationflags"] = CREATE_NO_WINDOW
     if stdin is not None:
@@ -368,8 +780,9 @@ def _create_process(args, stdin=None):
     return subprocess.Popen(
         args,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
+        # Never read, a full pipe would block the process
+        stderr=subprocess.DEVNULL,
+        bufsize=-1,
         shell=False,
         **cmd_args,
     )
@@ -18,6 +18,8 @@ ListItemsReturn = Union[List[str], Tuple[List[str], int], List[Tuple[str, Any]],
 
 # P = ParamSpec('P')
 
+_input_views: dict[int, sublime.View] = {}  # {window_id: Command Palette input view}
+
 
 def debounced(user_function: Callable[P, Any]) -> Callable[P, None]:
     """ A decorator which debounces the calls to a function.
@@ -113,17 +115,11 @@ class DynamicListInputHandler(sublime_plugin.ListInputHandler, metaclass=ABCMeta
         self.input_view: sublime.View | None = None
 
     def _attach_listener(self) -> None:
-        for buffer in sublime._buffers():  # type: ignore
-            view = buffer.primary_view()
-            # This condition to find the input field view might not be sufficient if there is another command palette
-            # open in another group in the same window
-            if view.element() == 'command_palette:input' and view.window() == self.command.window:
-                self.input_view = view
-                break
-        else:
+        self.input_view = _find_input_view(self.command.window)
+        if not self.input_view:
             raise RuntimeError('Could not find the Command Palette input field view')
         self.listener = InputListener(self)
-        self.listener.attach(buffer)
+        self.listener.attach(self.input_view.buffer())
         if ST_VERSION < 4161 and self.input_view:
             # Workaround for initial_selection not working; see https://github.com/sublimehq/sublime_text/issues/6175
             selection = self.input_view.sel()
@@ -196,11 +192,38 @@ class DynamicListInputHandler(sublime_plugin.ListInputHandler, metaclass=ABCMeta
         })
 
 
+def _find_input_view(window: sublime.Window) -> sublime.View | None:
+    """ Find the Command Palette input field view of the window.
+
+    The view is kept between two invocations of the command, so remember it instead of looking through all the
+    buffers each time the list items are updated.
+    """
+    view = _input_views.get(window.id())
+    if view and view.is_valid() and view.element() == 'command_palette:input' and view.window() == window:
+        return view
+    # Drop the stale view, it is replaced below if the input field is found
+    _input_views.pop(window.id(), None)
+    for buffer in sublime._buffers():  # type: ignore
+        view = buffer.primary_view()
+        # This condition to find the input field view might not be sufficient if there is another command palette
+        # open in another group in the same window
+        if view.element() == 'command_palette:input' and view.window() == window:
+            _input_views[window.id()] = view
+            return view
+    return None
+
+
+def forget_input_view(window: sublime.Window) -> None:
+    """ Forget the Command Palette input field view of a closed window. """
+    _input_views.pop(window.id(), None)
+
+
 class InputListener(sublime_plugin.TextChangeListener):
 
     def __init__(self, handler: DynamicListInputHandler) -> None:
         super().__init__()
         self.weakhandler = weakref.ref(handler)
+        self._last_change_count = -1
 
     @classmethod
     def is_applicable(cls, buffer: sublime.Buffer) -> bool:
@@ -213,4 +236,9 @@ class InputListener(sublime_plugin.TextChangeListener):
             return
         view = self.buffer.primary_view()
         if view and view.id():
+            # Skip the copy of the input text if nothing changed since the last call
+            change_count = view.change_count()
+            if change_count == self._last_change_count:
+                return
+            self._last_change_count = change_count
             handler.on_modified(view.substr(sublime.Region(0, view.size())))